@@ -0,0 +1,304 @@
+# Load-testing and benchmark harness for the TCP paths of ProxyServer.
+# Runs fully on localhost: the proxy is started in a child process, local echo and source targets and a
+# multi-connection SOCKS5 load generator run in this process. Results are written as JSON so runs can be
+# compared across commits, engines and relay modes.
+#
+# python benchmarks/bench_proxy.py --engine asyncio --relay auto --profile bulk --output results.json
+#
+# Measured:
+# o  handshakes/s and connection setup p50/p99 (TCP connect to SOCKS5 success reply).
+# o  bulk throughput of a single tunnel and of --parallel tunnels together.
+# o  proxy RSS and thread count per 1k open tunnels.
+# o  socket options the proxy set under --profile, scraped from its metrics endpoint.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def serve(args):
+    """ Child process, run the proxy until killed. """
+    sys.path.insert(0, SRC)
+    from maki_proxy import ProxyServer, raise_fd_limit
+    raise_fd_limit()
+    ProxyServer(host="127.0.0.1", port=args.port, engine=args.engine, relay=args.relay,
+                buffer_size=args.buffer_size, max_clients=4096, socket_profile=args.profile,
+                metrics_port=args.metrics_port).run()
+
+
+def start_proxy(args):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve",
+                                "--port", str(args.port), "--engine", args.engine, "--relay", args.relay,
+                                "--buffer-size", str(args.buffer_size), "--profile", args.profile,
+                                "--metrics-port", str(args.metrics_port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Proxy did not start listening.")
+
+
+def process_status(pid):
+    """ RSS in KiB and thread count of pid, from /proc (Linux only). """
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                key, _, value = line.partition(":")
+                status[key] = value.split()[0] if value.split() else ""
+    except OSError:
+        return None, None
+    return int(status.get("VmRSS", 0)), int(status.get("Threads", 0))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Targets:
+    """ Echo and bulk source servers on their own event loop thread. """
+
+    def __init__(self, bulk_bytes):
+        self.bulk_bytes = bulk_bytes
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        threading.Thread(target=self.run, name="targets", daemon=True).start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        echo = self.loop.run_until_complete(asyncio.start_server(self.echo, "127.0.0.1", 0, backlog=4096))
+        source = self.loop.run_until_complete(asyncio.start_server(self.source, "127.0.0.1", 0, backlog=4096))
+        self.echo_port = echo.sockets[0].getsockname()[1]
+        self.source_port = source.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    @staticmethod
+    async def echo(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def source(self, reader, writer):
+        chunk = b"\x00" * 262144
+        remaining = self.bulk_bytes
+        try:
+            while remaining > 0:
+                writer.write(chunk[:remaining])
+                remaining -= len(chunk)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def socks_connect(proxy_port, target_port):
+    """ SOCKS5 CONNECT without authentication, waiting for each reply like a regular client. """
+    reader, writer = await asyncio.open_connection("127.0.0.1", proxy_port)
+    writer.write(b"\x05\x01\x00")
+    if await reader.readexactly(2) != b"\x05\x00":
+        raise RuntimeError("Method negotiation failed.")
+    writer.write(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + target_port.to_bytes(2, "big"))
+    reply = await reader.readexactly(10)
+    if reply[1] != 0x00:
+        raise RuntimeError(f"CONNECT failed with REP {reply[1]:#04x}.")
+    return reader, writer
+
+
+async def bench_handshakes(proxy_port, target_port, total, concurrency):
+    latencies = []
+    errors = 0
+    queue = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in queue:
+            started = time.perf_counter()
+            try:
+                reader, writer = await socks_connect(proxy_port, target_port)
+            except (OSError, RuntimeError, asyncio.IncompleteReadError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "connections": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "handshakes_per_second": round(len(latencies) / elapsed, 1),
+        "setup_p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "setup_p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+async def bench_bulk(proxy_port, source_port, bulk_bytes, parallel):
+    async def download():
+        reader, writer = await socks_connect(proxy_port, source_port)
+        received = 0
+        started = time.perf_counter()
+        while True:
+            data = await reader.read(1048576)
+            if not data:
+                break
+            received += len(data)
+        elapsed = time.perf_counter() - started
+        writer.close()
+        return received, elapsed
+
+    received, elapsed = await download()
+    single = received * 8 / elapsed / 1e9
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(download() for _ in range(parallel)))
+    elapsed = time.perf_counter() - started
+    total = sum(received for received, _ in results)
+    return {
+        "bytes_per_tunnel": bulk_bytes,
+        "single_tunnel_gbit_per_second": round(single, 3),
+        "parallel_tunnels": parallel,
+        "aggregate_gbit_per_second": round(total * 8 / elapsed / 1e9, 3),
+    }
+
+
+async def bench_memory(proxy_pid, proxy_port, target_port, tunnels):
+    rss_before, threads_before = process_status(proxy_pid)
+    writers = []
+    for _ in range(tunnels):
+        _, writer = await socks_connect(proxy_port, target_port)
+        writers.append(writer)
+    await asyncio.sleep(0.5)
+    rss_after, threads_after = process_status(proxy_pid)
+    for writer in writers:
+        writer.close()
+    if rss_before is None:
+        return {"tunnels": tunnels, "supported": False}
+    scale = 1000 / tunnels
+    return {
+        "tunnels": tunnels,
+        "rss_kib_idle": rss_before,
+        "rss_kib_per_1k_tunnels": round((rss_after - rss_before) * scale, 1),
+        "threads_per_1k_tunnels": round((threads_after - threads_before) * scale, 1),
+    }
+
+
+def socket_options(metrics_port):
+    """ Times each socket option was set by the proxy, "profile/role/option" -> count. """
+    try:
+        text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5).read().decode()
+    except OSError:
+        return None
+    options = {}
+    for line in text.splitlines():
+        if line.startswith("maki_proxy_socket_options_total{"):
+            labels, value = line.split("{", 1)[1].rsplit("} ", 1)
+            labels = dict(label.split("=", 1) for label in labels.split(","))
+            key = "/".join(labels[name].strip('"') for name in ("profile", "role", "option"))
+            options[key] = int(float(value))
+    return options
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(SRC),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, proxy, targets):
+    return {
+        "handshake": await bench_handshakes(args.port, targets.echo_port, args.connections, args.concurrency),
+        "bulk": await bench_bulk(args.port, targets.source_port, args.bulk_bytes, args.parallel),
+        "memory": await bench_memory(proxy.pid, args.port, targets.echo_port, args.tunnels),
+        "socket_options": socket_options(args.metrics_port),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ProxyServer handshake and data paths on localhost.")
+    parser.add_argument("--engine", default="threaded")
+    parser.add_argument("--relay", default="auto")
+    parser.add_argument("--buffer-size", type=int, default=65536)
+    parser.add_argument("--profile", default="default", help="Socket profile of the proxy.")
+    parser.add_argument("--port", type=int, default=10798)
+    parser.add_argument("--metrics-port", type=int, default=10799)
+    parser.add_argument("--connections", type=int, default=5000, help="Handshakes to run.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Handshakes in flight.")
+    parser.add_argument("--bulk-bytes", type=int, default=256 * 1024 * 1024, help="Bytes per bulk tunnel.")
+    parser.add_argument("--parallel", type=int, default=4, help="Bulk tunnels run together.")
+    parser.add_argument("--tunnels", type=int, default=1000, help="Idle tunnels held for the memory test.")
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout.")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    targets = Targets(args.bulk_bytes)
+    proxy = start_proxy(args)
+    try:
+        results = asyncio.run(run(args, proxy, targets))
+    finally:
+        proxy.kill()
+        proxy.wait()
+
+    report = {
+        "benchmark": "bench_proxy",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "engine": args.engine,
+        "relay": args.relay,
+        "buffer_size": args.buffer_size,
+        "profile": args.profile,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# UDP ASSOCIATE echo benchmark.
+# Starts a local UDP echo server and a ProxyServer, then sends datagrams through a UDP association
+# and reports packets/s as a JSON line.
+#
+# python benchmarks/udp_echo.py --packets 200000 --size 64 --window 64
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from maki_proxy import ProxyServer  # noqa: E402
+
+
+def udp_echo_server():
+    """ UDP echo server on a random localhost port, drains the socket in batches. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+
+    def serve():
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        while True:
+            received, address = sock.recvfrom_into(buffer)
+            sock.sendto(view[:received], address)
+
+    threading.Thread(target=serve, name="udp-echo", daemon=True).start()
+    return sock.getsockname()
+
+
+def start_proxy(port, engine):
+    server = ProxyServer(host="127.0.0.1", port=port, engine=engine, max_clients=128)
+    server.serve_in_background()
+    return server
+
+
+def udp_associate(port):
+    """ Handshake without authentication and ask for UDP ASSOCIATE, returns (control socket, relay address). """
+    control = socket.create_connection(("127.0.0.1", port))
+    control.sendall(b"\x05\x01\x00" + b"\x05\x03\x00\x01" + b"\x00" * 6)
+    reply = b""
+    while len(reply) < 2 + 10:
+        reply += control.recv(64)
+    if reply[:2] != b"\x05\x00" or reply[3] != 0x00:
+        raise RuntimeError(f"UDP ASSOCIATE failed: {reply!r}")
+    relay_ip = socket.inet_ntoa(reply[6:10])
+    relay_port = int.from_bytes(reply[10:12], "big")
+    return control, (relay_ip, relay_port)
+
+
+def run(packets, size, window, engine, port):
+    echo_address = udp_echo_server()
+    server = start_proxy(port, engine)
+    # Port 0 picks a free port, the one bound is on the server.
+    control, relay_address = udp_associate(server.port)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(1.0)
+    header = b"\x00\x00\x00\x01" + socket.inet_aton(echo_address[0]) + echo_address[1].to_bytes(2, "big")
+    datagram = header + b"x" * size
+
+    sent = received = lost = 0
+    start = time.perf_counter()
+    while received + lost < packets:
+        while sent < packets and sent - received - lost < window:
+            client.sendto(datagram, relay_address)
+            sent += 1
+        try:
+            client.recv(65536)
+            received += 1
+        except socket.timeout:
+            # Count everything in flight as lost and refill the window.
+            lost += sent - received - lost
+    elapsed = time.perf_counter() - start
+    control.close()
+    server.stop(graceful=False)
+    return {
+        "benchmark": "udp_echo",
+        "engine": engine,
+        "packets": packets,
+        "payload_bytes": size,
+        "window": window,
+        "received": received,
+        "lost": lost,
+        "seconds": round(elapsed, 3),
+        "packets_per_second": round(received / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP ASSOCIATE echo benchmark, reports packets/s.")
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=64, help="Payload bytes per datagram.")
+    parser.add_argument("--window", type=int, default=64, help="Datagrams in flight.")
+    parser.add_argument("--engine", default="threaded")
+    parser.add_argument("--port", type=int, default=10797)
+    args = parser.parse_args()
+    print(json.dumps(run(args.packets, args.size, args.window, args.engine, args.port)))
+
+
+if __name__ == "__main__":
+    main()
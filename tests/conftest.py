@@ -0,0 +1,5 @@
+import os
+import sys
+
+# maki_proxy is a single module under src/, the same path the benchmarks import it from.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
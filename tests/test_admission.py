@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+from maki_proxy import AdmissionController
+
+
+def test_handshake_cap_queues_then_rejects():
+    admission = AdmissionController(max_handshakes=2, queue_timeout=0.1)
+    first, second = admission.admit("192.0.2.1"), admission.admit("192.0.2.2")
+    assert first is not None and second is not None
+    started = time.monotonic()
+    assert admission.admit("192.0.2.3") is None
+    assert time.monotonic() - started >= 0.1
+    assert admission.stats()["rejected_handshakes"] == 1
+    # Leaving the handshake stage frees the slot, tunnels are counted separately.
+    first.end_handshake()
+    assert admission.admit("192.0.2.3") is not None
+
+
+def test_queued_connection_is_admitted_when_a_slot_frees():
+    admission = AdmissionController(max_handshakes=1, queue_timeout=2.0)
+    ticket = admission.admit("192.0.2.1")
+    threading.Timer(0.05, ticket.release).start()
+    started = time.monotonic()
+    assert admission.admit("192.0.2.2") is not None
+    assert time.monotonic() - started < 1.0
+
+
+def test_per_ip_cap_counts_queued_connections():
+    admission = AdmissionController(max_handshakes=1, max_per_ip=2, queue_timeout=0.5)
+    held = admission.admit("192.0.2.1")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(admission.admit("192.0.2.1"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # One queued and timed out, two turned away straight away while it held the address's second slot.
+    assert results == [None, None, None]
+    assert admission.stats()["rejected_handshakes"] == 1
+    assert admission.rejected_per_ip == 2
+    assert admission.per_ip["192.0.2.1"] == 1
+    held.release()
+    assert admission.per_ip == {}
+
+
+def test_tunnel_cap_and_ticket_release():
+    admission = AdmissionController(max_tunnels=1, queue_timeout=0.1)
+    first, second = admission.admit("192.0.2.1"), admission.admit("192.0.2.2")
+    assert first.acquire_tunnel()
+    assert not second.acquire_tunnel()
+    assert admission.stats()["rejected_tunnels"] == 1
+    first.release()
+    first.release()
+    assert admission.stats()["tunnels"] == 0 and admission.stats()["handshakes"] == 1
+    assert second.acquire_tunnel()
+    second.release()
+    assert admission.stats() == {"handshakes": 0, "tunnels": 0, "rejected_handshakes": 0, "rejected_tunnels": 1,
+                                 "rejected_per_ip": 0}
+
+
+def test_coroutines_wait_for_slots_freed_by_threads():
+    admission = AdmissionController(max_handshakes=1, max_tunnels=1, queue_timeout=2.0)
+
+    async def main():
+        ticket = await admission.admit_async("192.0.2.1")
+        assert await ticket.acquire_tunnel_async()
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, lambda: threading.Thread(target=ticket.release).start())
+        started = loop.time()
+        waiting = await admission.admit_async("192.0.2.2")
+        assert waiting is not None and loop.time() - started < 1.0
+        assert await waiting.acquire_tunnel_async()
+        admission.queue_timeout = 0.1
+        assert await admission.admit_async("192.0.2.3") is None
+        assert not await admission.acquire_tunnel_async()
+        waiting.release()
+
+    asyncio.run(main())
+    assert admission.stats()["handshakes"] == 0 and admission.stats()["tunnels"] == 0
+    assert admission.per_ip == {}
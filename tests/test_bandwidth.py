@@ -0,0 +1,94 @@
+import heapq
+
+import pytest
+
+import maki_proxy
+from maki_proxy import BandwidthLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(maki_proxy, "time", clock)
+    return clock
+
+
+def simulate(clock, limiter, flows, seconds=10.0):
+    """ Run flows of (username, bytes per read, seconds between reads) against limiter, each waiting the
+    delay its throttle returns. Returns the rate of each flow over the second half of the run.
+    """
+    throttles = [limiter.open(username) for username, _, _ in flows]
+    sent = [0] * len(flows)
+    start = clock.now
+    queue = [(start, index) for index in range(len(flows))]
+    while queue:
+        clock.now, index = heapq.heappop(queue)
+        if clock.now > start + seconds:
+            break
+        _, size, interval = flows[index]
+        delay = throttles[index].consume(size)
+        if clock.now >= start + seconds / 2:
+            sent[index] += size
+        heapq.heappush(queue, (clock.now + max(delay, interval), index))
+    for throttle in throttles:
+        throttle.close()
+    return [total / (seconds / 2) for total in sent]
+
+
+def test_token_bucket_debt():
+    bucket = TokenBucket(1000, burst=500)
+    assert bucket.consume(500, bucket.updated) == 0.0
+    assert bucket.consume(1000, bucket.updated) == pytest.approx(1.0)
+    assert bucket.consume(0, bucket.updated + 1.5) == 0.0
+
+
+def test_global_rate_is_shared_by_every_tunnel(clock):
+    limiter = BandwidthLimiter(global_rate=1_000_000)
+    rates = simulate(clock, limiter, [("a", 65536, 0.0), ("b", 65536, 0.0)])
+    assert sum(rates) == pytest.approx(1_000_000, rel=0.05)
+
+
+def test_user_rate_covers_all_of_a_users_tunnels(clock):
+    limiter = BandwidthLimiter(user_rate={"slow": 100_000, None: None})
+    rates = simulate(clock, limiter, [("slow", 16384, 0.0), ("slow", 16384, 0.0), ("fast", 16384, 0.01)])
+    assert rates[0] + rates[1] == pytest.approx(100_000, rel=0.1)
+    assert rates[2] == pytest.approx(16384 / 0.01, rel=0.05)
+
+
+def test_connection_rate(clock):
+    limiter = BandwidthLimiter(connection_rate=200_000)
+    rates = simulate(clock, limiter, [("a", 16384, 0.0), ("a", 16384, 0.0)])
+    assert rates == [pytest.approx(200_000, rel=0.1)] * 2
+
+
+def test_fair_share_splits_evenly_between_bulk_users(clock):
+    limiter = BandwidthLimiter(global_rate=1_000_000, fair_share=True)
+    rates = simulate(clock, limiter, [("a", 65536, 0.0), ("b", 65536, 0.0)])
+    assert rates == [pytest.approx(500_000, rel=0.1)] * 2
+
+
+def test_fair_share_gives_what_light_users_leave_to_the_others(clock):
+    limiter = BandwidthLimiter(global_rate=1_000_000, fair_share=True)
+    bulk, medium, light = simulate(clock, limiter, [("bulk", 65536, 0.0), ("medium", 16384, 0.1),
+                                                    ("light", 500, 1.0)])
+    # Light and medium users get all they ask for, the bulk user the rest of the link.
+    assert light == pytest.approx(500, rel=0.25)
+    assert medium == pytest.approx(163_840, rel=0.05)
+    assert bulk + medium + light == pytest.approx(1_000_000, rel=0.05)
+    # Closed throttles drop their users.
+    assert limiter.users == {}
+
+
+def test_fair_share_respects_user_rate(clock):
+    limiter = BandwidthLimiter(global_rate=1_000_000, user_rate={"capped": 200_000, None: None}, fair_share=True)
+    capped, other = simulate(clock, limiter, [("capped", 65536, 0.0), ("other", 65536, 0.0)])
+    assert capped == pytest.approx(200_000, rel=0.1)
+    assert other == pytest.approx(800_000, rel=0.1)
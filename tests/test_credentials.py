@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import hashlib
+import time
+
+from maki_proxy import (CredentialVerifier, FileCredentialStore, MemoryCredentialStore, SingleUserCredentialStore,
+                        SQLiteCredentialStore, check_password, hash_password)
+
+
+def test_hash_round_trip():
+    encoded = hash_password("secret")
+    assert encoded.startswith("scrypt$")
+    assert check_password("secret", encoded)
+    assert not check_password("Secret", encoded)
+    # Every hash gets its own salt.
+    assert hash_password("secret") != encoded
+
+
+def test_pbkdf2_and_malformed_hashes():
+    salt = b"0123456789abcdef"
+    digest = hashlib.pbkdf2_hmac("sha256", b"secret", salt, 1000, 32)
+    encoded = f"pbkdf2_sha256$1000${base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}"
+    assert check_password("secret", encoded)
+    assert not check_password("wrong", encoded)
+    for bad in ("", "plain", "md5$abc$def", "scrypt$x$8$1$AAAA$AAAA", "scrypt$16384$8$1$!!$!!"):
+        assert not check_password("secret", bad)
+
+
+def test_file_store_reloads_on_change(tmp_path):
+    path = tmp_path / "users"
+    path.write_text(f"# accounts\n\nalice:{hash_password('a')}\n")
+    store = FileCredentialStore(str(path), check_interval=0.0)
+    assert check_password("a", store.lookup("alice"))
+    assert store.lookup("bob") is None
+    version = store.version
+    path.write_text(f"alice:{hash_password('a')}\nbob:{hash_password('b')}\n")
+    assert check_password("b", store.lookup("bob"))
+    assert store.version > version
+
+
+def test_file_store_keeps_accounts_when_the_file_breaks(tmp_path):
+    path = tmp_path / "users"
+    path.write_text(f"alice:{hash_password('a')}\n")
+    store = FileCredentialStore(str(path), check_interval=0.0)
+    path.write_text("no separator on this line\n")
+    assert check_password("a", store.lookup("alice"))
+
+
+def test_sqlite_store(tmp_path):
+    store = SQLiteCredentialStore(str(tmp_path / "users.db"))
+    store.add("alice", "a")
+    assert check_password("a", store.lookup("alice"))
+    store.remove("alice")
+    assert store.lookup("alice") is None
+
+
+def test_single_user_store_hashes_lazily():
+    store = SingleUserCredentialStore("alice", "a")
+    assert store.encoded is None
+    assert store.lookup("bob") is None
+    assert store.encoded is None
+    encoded = store.lookup("alice")
+    assert check_password("a", encoded)
+    assert store.lookup("alice") is encoded
+
+
+def test_verifier_caches_successes_only():
+    store = MemoryCredentialStore()
+    store.add("alice", "a")
+    verifier = CredentialVerifier(store)
+    try:
+        assert verifier.verify("alice", "a")
+        assert verifier.verify("alice", "a")
+        assert not verifier.verify("alice", "wrong")
+        assert not verifier.verify("nobody", "a")
+        stats = verifier.stats()
+        assert stats["entries"] == 1
+        assert stats["hits"] == 1
+        assert stats["failures"] == 2
+        # The unknown user was checked against the dummy hash rather than answered straight away.
+        assert verifier.dummy_hash is not None
+    finally:
+        verifier.close()
+
+
+def test_verifier_cache_follows_store_changes():
+    store = MemoryCredentialStore()
+    store.add("alice", "a")
+    verifier = CredentialVerifier(store)
+    try:
+        assert verifier.verify("alice", "a")
+        store.add("alice", "b")
+        assert not verifier.cached("alice", "a")
+        assert not verifier.verify("alice", "a")
+        assert verifier.verify("alice", "b")
+        store.remove("alice")
+        assert not verifier.verify("alice", "b")
+    finally:
+        verifier.close()
+
+
+def test_verifier_cache_expires():
+    store = MemoryCredentialStore()
+    store.add("alice", "a")
+    verifier = CredentialVerifier(store, cache_ttl=0.05)
+    try:
+        assert verifier.verify("alice", "a")
+        assert verifier.cached("alice", "a")
+        time.sleep(0.1)
+        assert not verifier.cached("alice", "a")
+    finally:
+        verifier.close()
+
+
+def test_verifier_evicts_oldest_entries():
+    store = MemoryCredentialStore()
+    for name in ("alice", "bob", "carol"):
+        store.add(name, name)
+    verifier = CredentialVerifier(store, max_entries=2)
+    try:
+        for name in ("alice", "bob", "carol"):
+            assert verifier.verify(name, name)
+        assert list(verifier.cache) == ["bob", "carol"]
+    finally:
+        verifier.close()
+
+
+def test_verify_async():
+    store = MemoryCredentialStore()
+    store.add("alice", "a")
+    verifier = CredentialVerifier(store)
+
+    async def main():
+        return [await verifier.verify_async("alice", "a"), await verifier.verify_async("alice", "a"),
+                await verifier.verify_async("alice", "wrong")]
+
+    try:
+        assert asyncio.run(main()) == [True, True, False]
+        assert verifier.stats()["hits"] == 1
+    finally:
+        verifier.close()
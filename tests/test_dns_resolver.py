@@ -0,0 +1,106 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from maki_proxy import DnsResolver
+
+
+class FakeDns:
+    """ Stand-in for getaddrinfo(), names map to an answer or an exception, calls are counted. """
+
+    def __init__(self, answers, gate=None):
+        self.answers = answers
+        self.gate = gate
+        self.calls = []
+
+    def __call__(self, name):
+        self.calls.append(name)
+        if self.gate is not None:
+            self.gate.wait(2.0)
+        answer = self.answers[name]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def settle(resolver):
+    """ Wait for answers to be stored, the done callback storing them can run after result() returns. """
+    deadline = time.monotonic() + 2.0
+    while resolver.pending and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def resolver():
+    resolver = DnsResolver(max_entries=2, positive_ttl=0.2, negative_ttl=0.2)
+    yield resolver
+    resolver.close()
+
+
+def test_answers_are_cached_until_the_ttl(resolver):
+    resolver._getaddrinfo = FakeDns({"a.test": [(socket.AF_INET, "192.0.2.1")]})
+    assert resolver.resolve("a.test") == [(socket.AF_INET, "192.0.2.1")]
+    settle(resolver)
+    assert resolver.resolve("a.test") == [(socket.AF_INET, "192.0.2.1")]
+    assert resolver._getaddrinfo.calls == ["a.test"]
+    assert resolver.stats()["hits"] == 1 and resolver.stats()["misses"] == 1
+    time.sleep(0.25)
+    assert resolver.cached("a.test") is None
+    resolver.resolve("a.test")
+    assert resolver._getaddrinfo.calls == ["a.test", "a.test"]
+
+
+def test_concurrent_lookups_share_one_call(resolver):
+    gate = threading.Event()
+    resolver._getaddrinfo = FakeDns({"a.test": [(socket.AF_INET, "192.0.2.1")]}, gate)
+    futures = [resolver.lookup("a.test") for _ in range(5)]
+    gate.set()
+    assert {tuple(future.result(2.0)) for future in futures} == {((socket.AF_INET, "192.0.2.1"),)}
+    assert resolver._getaddrinfo.calls == ["a.test"]
+    assert resolver.stats()["coalesced"] == 4
+
+
+def test_failures_are_cached_and_raised_as_new_exceptions(resolver):
+    resolver._getaddrinfo = FakeDns({"bad.test": socket.gaierror(socket.EAI_NONAME, "Name or service not known")})
+    with pytest.raises(socket.gaierror):
+        resolver.resolve("bad.test")
+    settle(resolver)
+    errors = []
+    for _ in range(2):
+        with pytest.raises(socket.gaierror) as error:
+            resolver.resolve("bad.test")
+        errors.append(error.value)
+    assert errors[0] is not errors[1]
+    assert errors[0].errno == socket.EAI_NONAME
+    assert resolver._getaddrinfo.calls == ["bad.test"]
+    assert resolver.stats()["negative_hits"] == 2
+
+
+def test_unexpected_errors_are_not_cached(resolver):
+    resolver._getaddrinfo = FakeDns({"odd.test": RuntimeError("resolver bug")})
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            resolver.resolve("odd.test")
+        settle(resolver)
+    assert resolver._getaddrinfo.calls == ["odd.test", "odd.test"]
+
+
+def test_least_recently_used_names_are_evicted(resolver):
+    resolver._getaddrinfo = FakeDns({name: [(socket.AF_INET, "192.0.2.1")] for name in ("a", "b", "c")})
+    for name in ("a", "b", "a", "c"):
+        resolver.resolve(name)
+        settle(resolver)
+    assert resolver.cached("b") is None
+    assert resolver.cached("a") is not None and resolver.cached("c") is not None
+    assert resolver.stats()["evictions"] == 1
+
+
+def test_resolve_async(resolver):
+    resolver._getaddrinfo = FakeDns({"a.test": [(socket.AF_INET6, "2001:db8::1")]})
+    assert asyncio.run(resolver.resolve_async("a.test")) == [(socket.AF_INET6, "2001:db8::1")]
+    settle(resolver)
+    assert asyncio.run(resolver.resolve_async("a.test")) == [(socket.AF_INET6, "2001:db8::1")]
+    assert resolver._getaddrinfo.calls == ["a.test"]
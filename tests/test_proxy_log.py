@@ -0,0 +1,113 @@
+import io
+import json
+import time
+
+import pytest
+
+from maki_proxy import BYTES_CLIENT_TO_TARGET, DEBUG, WARNING, AccessRecord, ProxyLog
+
+
+def make_log(**kwargs):
+    # A long flush interval keeps the writer thread out of the way, the tests flush by hand.
+    stream = io.StringIO()
+    return ProxyLog(stream=stream, flush_interval=60.0, **kwargs), stream
+
+
+def lines(stream):
+    return stream.getvalue().splitlines()
+
+
+def test_levels_filter_records():
+    log, stream = make_log(level="warning")
+    assert log.level == WARNING
+    log.info("hidden %d", 1)
+    log.warning("shown %d", 2)
+    log.level = DEBUG
+    log.debug("now shown %s", "too")
+    log.flush()
+    assert lines(stream) == ["[WARNING] - shown 2", "[DEBUG] - now shown too"]
+
+
+def test_access_records_follow_level():
+    log, stream = make_log()
+    record = AccessRecord(("192.0.2.1", 1080))
+    record.user = "alice"
+    record.reply = 0
+    log.access(record)
+    log.flush()
+    [line] = lines(stream)
+    assert line.startswith("[ACCESS] - client=192.0.2.1:1080 user=alice ")
+    assert "reply=0x00" in line
+    log.level = "off"
+    log.access(AccessRecord(("192.0.2.1", 1080)))
+    log.error("nothing at all")
+    log.flush()
+    assert len(lines(stream)) == 1
+    quiet, stream = make_log(access=False)
+    quiet.access(AccessRecord(("192.0.2.1", 1080)))
+    quiet.flush()
+    assert lines(stream) == []
+
+
+def test_json_format():
+    log, stream = make_log(format="json")
+    log.error("failed %s", "here")
+    record = AccessRecord(("::1", 5000))
+    record.bytes[BYTES_CLIENT_TO_TARGET] += 3
+    log.access(record)
+    log.flush()
+    message, access = (json.loads(line) for line in lines(stream))
+    assert message["level"] == "error" and message["message"] == "failed here"
+    assert message["time"].endswith("Z")
+    assert access["event"] == "access" and access["client"] == "::1:5000" and access["bytes_up"] == 3
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        ProxyLog(format="xml")
+
+
+def test_bad_arguments_are_rendered_not_raised():
+    log, stream = make_log()
+    log.info("two %s %s", "only one")
+    log.info("literal %d")
+    log.flush()
+    first, second = lines(stream)
+    assert "bad log arguments" in first and "only one" in first
+    assert second == "[INFO] - literal %d"
+
+
+def test_rate_limit_suppresses_and_reports():
+    log, stream = make_log(rate_limit=3)
+    for number in range(10):
+        log.info("flood %d", number)
+    log.info("other")
+    log.flush()
+    assert lines(stream) == ["[INFO] - flood 0", "[INFO] - flood 1", "[INFO] - flood 2", "[INFO] - other"]
+    # The window for the message is over, the next record reports what was held back.
+    log.windows["flood %d"][0] -= 1.0
+    log.info("flood %d", 10)
+    log.flush()
+    assert lines(stream)[-2:] == ["[WARNING] - Suppressed 7 more records like 'flood %d' in the last second.",
+                                  "[INFO] - flood 10"]
+    assert log.stats()["suppressed"] == 7
+
+
+def test_full_queue_drops_records():
+    log, stream = make_log(max_queue=2, rate_limit=None)
+    for number in range(5):
+        log.info("record %d", number)
+    assert log.stats() == {"queued": 2, "dropped": 3, "suppressed": 0}
+    log.flush()
+    assert lines(stream) == ["[INFO] - record 0", "[INFO] - record 1"]
+    assert log.stats()["queued"] == 0
+
+
+def test_writer_thread_flushes():
+    stream = io.StringIO()
+    log = ProxyLog(stream=stream, flush_interval=0.01)
+    log.info("in the background")
+    deadline = time.monotonic() + 2.0
+    while not stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert lines(stream) == ["[INFO] - in the background"]
@@ -0,0 +1,93 @@
+import ipaddress
+import random
+
+import pytest
+
+from maki_proxy import AclRule, Ruleset
+
+USERS = [None, "maki", "guest"]
+SOURCES = ["10.0.0.1", "10.0.1.1", "192.168.1.5", "::1"]
+DESTINATIONS = ["93.184.216.34", "10.0.0.7", "127.0.0.1", "2001:db8::1", "2001:db8:1::1"]
+NETWORKS = ["10.0.0.0/8", "10.0.0.0/24", "127.0.0.0/8", "93.184.216.0/24", "0.0.0.0/0", "2001:db8::/32",
+            "2001:db8::/48", "::/0"]
+DOMAINS = [None, "example.com", "www.example.com", "example.org", "a.b.example.org"]
+SUFFIXES = ["example.com", "www.example.com", "org", "b.example.org"]
+PORTS = [22, 80, 443, 8080, 8443]
+
+
+def naive_check(rules, default, user, source, port, domain, address):
+    """ The first rule matching every field decides, as documented on AclRule. """
+    def in_networks(ip, networks):
+        ip = ipaddress.ip_address(ip)
+        return any(ip in ipaddress.ip_network(network) for network in networks)
+
+    def in_ports(ports):
+        return any(port == entry if isinstance(entry, int) else entry[0] <= port <= entry[1] for entry in ports)
+
+    def in_domains(suffixes):
+        return domain is not None and any(domain == suffix or domain.endswith("." + suffix) for suffix in suffixes)
+
+    for rule in rules:
+        if (rule.users is None or user in rule.users) and \
+                (rule.sources is None or in_networks(source, rule.sources)) and \
+                (rule.destinations is None or in_networks(address, rule.destinations)) and \
+                (rule.domains is None or in_domains(rule.domains)) and \
+                (rule.ports is None or in_ports(rule.ports)):
+            return rule.action == "allow"
+    return default == "allow"
+
+
+def random_rule(rng):
+    def maybe(values, count):
+        return None if rng.random() < 0.5 else rng.sample(values, rng.randint(1, count))
+    ports = None
+    if rng.random() < 0.5:
+        low = rng.choice(PORTS)
+        ports = [low if rng.random() < 0.5 else (low, low + rng.choice([0, 100, 10000]))]
+    return AclRule(rng.choice(["allow", "deny"]), users=maybe(USERS[1:], 2), sources=maybe(NETWORKS, 2),
+                   destinations=maybe(NETWORKS, 2), domains=maybe(SUFFIXES, 2), ports=ports)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_check_matches_naive_first_match(seed):
+    rng = random.Random(seed)
+    rules = [random_rule(rng) for _ in range(rng.randint(1, 12))]
+    default = rng.choice(["allow", "deny"])
+    ruleset = Ruleset(rules, default=default)
+    for _ in range(200):
+        user, source, port = rng.choice(USERS), rng.choice(SOURCES), rng.choice(PORTS)
+        domain, address = rng.choice(DOMAINS), rng.choice(DESTINATIONS)
+        expected = naive_check(rules, default, user, source, port, domain, address)
+        assert ruleset.check(user, source, port, domain, address) == expected
+
+
+def test_unresolved_domain_waits_for_address_only_when_needed():
+    ruleset = Ruleset([AclRule("deny", destinations=["10.0.0.0/8"]), AclRule("allow", domains=["example.com"])],
+                      default="deny")
+    assert ruleset.check(None, "192.168.1.5", 80, domain="example.com") is None
+    assert ruleset.check(None, "192.168.1.5", 80, domain="example.com", address="10.1.1.1") is False
+    assert ruleset.check(None, "192.168.1.5", 80, domain="example.com", address="93.184.216.34") is True
+    first = Ruleset([AclRule("allow", domains=["example.com"]), AclRule("deny", destinations=["10.0.0.0/8"])])
+    assert first.check(None, "192.168.1.5", 80, domain="example.com") is True
+
+
+def test_unknown_action_is_rejected():
+    with pytest.raises(ValueError):
+        Ruleset([AclRule("block")])
+
+
+def test_ipv4_mapped_addresses_match_ipv4_rules():
+    ruleset = Ruleset([AclRule("deny", destinations=["127.0.0.0/8", "::1/128"]),
+                       AclRule("deny", sources=["192.168.0.0/16"])])
+    assert ruleset.check(None, "10.0.0.1", 80, address="127.0.0.1") is False
+    assert ruleset.check(None, "10.0.0.1", 80, address="::ffff:127.0.0.1") is False
+    assert ruleset.check(None, "::ffff:192.168.1.5", 80, address="93.184.216.34") is False
+    assert ruleset.check(None, "::ffff:10.0.0.1", 80, address="::ffff:93.184.216.34") is True
+    assert ruleset.check(None, "10.0.0.1", 80, address="fe80::1%lo") is True
+
+
+def test_ipv4_mapped_networks_match_ipv4_addresses():
+    ruleset = Ruleset([AclRule("deny", destinations=["::ffff:10.0.0.0/104"])])
+    assert ruleset.check(None, "192.168.1.5", 80, address="10.1.2.3") is False
+    assert ruleset.check(None, "192.168.1.5", 80, address="::ffff:10.1.2.3") is False
+    assert ruleset.check(None, "192.168.1.5", 80, address="11.1.2.3") is True
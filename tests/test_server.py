@@ -0,0 +1,247 @@
+import contextlib
+import io
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from maki_proxy import BYTES_CLIENT_TO_TARGET, ENGINES, AclRule, ProxyLog, ProxyServer, Ruleset, Socks5Parser, Upstream, UpstreamRouter, socks_request
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def helper_threads():
+    return [thread.name for thread in threading.enumerate() if thread.name.startswith(("dns", "auth"))]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_start_stop_cycles_release_threads_and_port(engine):
+    for _ in range(3):
+        server = ProxyServer(host="127.0.0.1", port=0, engine=engine, username="maki", password="secret",
+                             drain_timeout=1.0)
+        server.serve_in_background()
+        assert server.ready.is_set() and server.port != 0
+        # Authenticate and resolve a name so the auth and DNS thread pools start.
+        with socket.create_connection(("127.0.0.1", server.port)) as client:
+            client.sendall(b"\x05\x01\x02" + b"\x01\x04maki\x06secret" + socks_request(3, "localhost", 9))
+            assert client.recv(2) == b"\x05\x02"
+            assert client.recv(2) == b"\x01\x00"
+            assert client.recv(2)[:1] == b"\x05"
+        server.stop()
+        assert server.stopped.is_set()
+        # The port is free again once stop() returns.
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", server.port))
+    assert wait_for(lambda: not helper_threads()), helper_threads()
+
+
+def test_construction_binds_nothing():
+    started = time.monotonic()
+    server = ProxyServer(host="127.0.0.1", port=0, username="maki", password="secret")
+    assert time.monotonic() - started < 0.1
+    assert server.sock is None and not server.ready.is_set()
+
+
+def test_stop_after_start_without_serving():
+    server = ProxyServer(host="127.0.0.1", port=0)
+    server.start()
+    port = server.port
+    server.stop()
+    assert server.stopped.is_set()
+    with pytest.raises(OSError):
+        socket.create_connection(("127.0.0.1", port), timeout=1.0)
+
+
+def test_shared_resolver_is_left_open():
+    server = ProxyServer(host="127.0.0.1", port=0)
+    other = ProxyServer(host="127.0.0.1", port=0, resolver=server.resolver)
+    other.start()
+    other.stop()
+    assert server.resolver.resolve("localhost")
+
+
+@contextlib.contextmanager
+def serving(engine, **kwargs):
+    server = ProxyServer(host="127.0.0.1", port=0, engine=engine, drain_timeout=0.5, **kwargs)
+    server.serve_in_background()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def echo_server():
+    """ TCP server echoing everything back, yields its port. """
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+
+    def echo(connection):
+        with connection:
+            while True:
+                data = connection.recv(65536)
+                if not data:
+                    return
+                connection.sendall(data)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=echo, args=(connection,), daemon=True).start()
+    threading.Thread(target=serve, daemon=True).start()
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+def recv_exactly(sock, length):
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def socks_reply(server, message):
+    """ Send message after a no-auth greeting, returns the method selected and the reply's REP code. """
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5.0) as client:
+        client.sendall(b"\x05\x01\x00" + message)
+        method = recv_exactly(client, 2)
+        reply = recv_exactly(client, 2)
+        return method[1], reply[1] if len(reply) == 2 else None
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pipelined_connect_relays_and_counts_early_data(engine, echo_server):
+    stream = io.StringIO()
+    log = ProxyLog(format="json", stream=stream)
+    with serving(engine, secure=False, log=log) as server:
+        with socket.create_connection(("127.0.0.1", server.port), timeout=5.0) as client:
+            client.sendall(b"\x05\x01\x00" + socks_request(1, "127.0.0.1", echo_server) + b"early")
+            assert recv_exactly(client, 2) == b"\x05\x00"
+            assert recv_exactly(client, 10)[:4] == b"\x05\x00\x00\x01"
+            assert recv_exactly(client, 5) == b"early"
+            client.sendall(b"later")
+            assert recv_exactly(client, 5) == b"later"
+    log.flush()
+    access = [record for record in map(json.loads, stream.getvalue().splitlines()) if record.get("event") == "access"]
+    assert [(record["bytes_up"], record["bytes_down"]) for record in access] == [(10, 10)]
+    assert server.stats.snapshot()[BYTES_CLIENT_TO_TARGET] == 10
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_username_password(engine):
+    with serving(engine, username="maki", password="secret") as server:
+        for password, status in ((b"secret", 0x00), (b"wrong", 0x01)):
+            with socket.create_connection(("127.0.0.1", server.port), timeout=5.0) as client:
+                client.sendall(b"\x05\x01\x02\x01\x04maki" + bytes([len(password)]) + password)
+                assert recv_exactly(client, 2) == b"\x05\x02"
+                assert recv_exactly(client, 2) == bytes([1, status])
+        with socket.create_connection(("127.0.0.1", server.port), timeout=5.0) as client:
+            # No acceptable methods, the server only takes username/password.
+            client.sendall(b"\x05\x01\x00")
+            assert recv_exactly(client, 2) == b"\x05\xff"
+            assert client.recv(1) == b""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_reply_codes(engine, echo_server):
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    ruleset = Ruleset([AclRule("deny", destinations=["127.0.0.2/32"])])
+    with serving(engine, secure=False, ruleset=ruleset) as server:
+        assert socks_reply(server, socks_request(1, "127.0.0.1", echo_server)) == (0x00, 0x00)
+        assert socks_reply(server, socks_request(1, "127.0.0.1", closed_port)) == (0x00, 0x05)
+        assert socks_reply(server, socks_request(1, "127.0.0.2", echo_server)) == (0x00, 0x02)
+        assert socks_reply(server, socks_request(3, "nonexistent.invalid", 80)) == (0x00, 0x04)
+        assert socks_reply(server, b"\x05\x02\x00\x01\x7f\x00\x00\x01\x00\x50") == (0x00, 0x07)
+        assert socks_reply(server, b"\x05\x01\x00\x09\x7f\x00\x00\x01\x00\x50") == (0x00, 0x08)
+        # UDP ASSOCIATE from any port.
+        assert socks_reply(server, b"\x05\x03\x00\x01\x00\x00\x00\x00\x00\x00") == (0x00, 0x00)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_tunnel_limit(engine, echo_server):
+    with serving(engine, secure=False, max_tunnels=1, admission_timeout=0.2) as server:
+        with socket.create_connection(("127.0.0.1", server.port), timeout=5.0) as first:
+            first.sendall(b"\x05\x01\x00" + socks_request(1, "127.0.0.1", echo_server))
+            assert recv_exactly(first, 12)[3] == 0x00
+            assert socks_reply(server, socks_request(1, "127.0.0.1", echo_server)) == (0x00, 0x01)
+
+
+@pytest.fixture
+def socks_upstream():
+    """ SOCKS5 upstream that records the requests it is sent, answers success and then echoes. """
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    requests = []
+
+    def handle(connection):
+        with connection:
+            parser = Socks5Parser()
+            parser.feed(connection.recv(4096))
+            while parser.next_event() is None:
+                parser.feed(connection.recv(4096))
+            parser.select_method(0x00)
+            connection.sendall(b"\x05\x00")
+            request = parser.next_event()
+            while request is None:
+                parser.feed(connection.recv(4096))
+                request = parser.next_event()
+            requests.append(request)
+            connection.sendall(b"\x05\x00\x00\x01\x7f\x00\x00\x01\x00\x00")
+            while True:
+                data = connection.recv(65536)
+                if not data:
+                    return
+                connection.sendall(data)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(connection,), daemon=True).start()
+    threading.Thread(target=serve, daemon=True).start()
+    yield Upstream(f"socks5://127.0.0.1:{listener.getsockname()[1]}", pool_size=0), requests
+    listener.close()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_upstream_gets_the_address_the_ruleset_allowed(engine, socks_upstream):
+    upstream, requests = socks_upstream
+    # The decision for localhost depends on what it resolves to.
+    ruleset = Ruleset([AclRule("deny", destinations=["10.0.0.0/8"])])
+    with serving(engine, secure=False, ruleset=ruleset, upstreams=UpstreamRouter(default=upstream)) as server:
+        assert socks_reply(server, socks_request(3, "localhost", 80)) == (0x00, 0x00)
+    assert len(requests) == 1
+    assert requests[0].address_type in (1, 4)
+    assert requests[0].address in {info[4][0] for info in socket.getaddrinfo("localhost", 80)}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_upstream_is_not_asked_for_a_denied_name(engine, socks_upstream):
+    upstream, requests = socks_upstream
+    ruleset = Ruleset([AclRule("deny", destinations=["127.0.0.0/8", "::1/128"])])
+    with serving(engine, secure=False, ruleset=ruleset, upstreams=UpstreamRouter(default=upstream)) as server:
+        assert socks_reply(server, socks_request(3, "localhost", 80)) == (0x00, 0x02)
+        # Decided without the addresses, the name is forwarded for the upstream to resolve.
+        server.ruleset = Ruleset([AclRule("deny", domains=["example.com"])])
+        assert socks_reply(server, socks_request(3, "localhost", 80)) == (0x00, 0x00)
+    assert [(request.address_type, request.address) for request in requests] == [(3, "localhost")]
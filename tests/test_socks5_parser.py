@@ -0,0 +1,69 @@
+import socket
+
+import pytest
+
+from maki_proxy import AuthRequest, Greeting, Request, Socks5Parser, Socks5ProtocolError
+
+GREETING = b"\x05\x02\x00\x02"
+AUTH = b"\x01\x04maki\x08password"
+REQUEST_IPV4 = b"\x05\x01\x00\x01" + socket.inet_aton("10.1.2.3") + (443).to_bytes(2, "big")
+
+
+def test_pipelined_handshake_in_one_segment():
+    parser = Socks5Parser()
+    parser.feed(GREETING + AUTH + REQUEST_IPV4 + b"GET / HTTP/1.1\r\n")
+    assert parser.next_event() == Greeting(b"\x00\x02")
+    # Nothing more until the server has picked a method.
+    assert parser.next_event() is None
+    parser.select_method(0x02)
+    assert parser.next_event() == AuthRequest("maki", "password")
+    assert parser.next_event() == Request(1, 1, "10.1.2.3", 443)
+    assert parser.next_event() is None
+    assert parser.leftover() == b"GET / HTTP/1.1\r\n"
+
+
+def test_partial_input_byte_by_byte():
+    parser = Socks5Parser()
+    events = []
+    for byte in GREETING + REQUEST_IPV4:
+        parser.feed(bytes([byte]))
+        event = parser.next_event()
+        if event is not None:
+            events.append(event)
+            if isinstance(event, Greeting):
+                parser.select_method(0x00)
+    assert events == [Greeting(b"\x00\x02"), Request(1, 1, "10.1.2.3", 443)]
+    assert parser.leftover() == b""
+
+
+@pytest.mark.parametrize("address_type, packed, address", [
+    (3, b"\x0bexample.com", "example.com"),
+    (3, b"\x10xn--bcher-kva.de", "bücher.de"),
+    (4, socket.inet_pton(socket.AF_INET6, "2001:db8::1"), "2001:db8::1"),
+])
+def test_request_address_types(address_type, packed, address):
+    parser = Socks5Parser()
+    parser.feed(b"\x05\x01\x00")
+    parser.next_event()
+    parser.select_method(0x00)
+    parser.feed(bytes([5, 1, 0, address_type]) + packed + (80).to_bytes(2, "big"))
+    assert parser.next_event() == Request(1, address_type, address, 80)
+
+
+def test_bad_address_type_replies_0x08():
+    parser = Socks5Parser()
+    parser.feed(b"\x05\x01\x00")
+    parser.next_event()
+    parser.select_method(0x00)
+    parser.feed(b"\x05\x01\x00\x07" + b"\x00" * 6)
+    with pytest.raises(Socks5ProtocolError) as error:
+        parser.next_event()
+    assert error.value.reply_code == 0x08
+
+
+@pytest.mark.parametrize("greeting", [b"\x04\x01\x00", b"\x05\x00"])
+def test_bad_greeting(greeting):
+    parser = Socks5Parser()
+    parser.feed(greeting)
+    with pytest.raises(Socks5ProtocolError):
+        parser.next_event()
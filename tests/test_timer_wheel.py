@@ -0,0 +1,40 @@
+from maki_proxy import TimerWheel
+
+
+def test_timers_fire_once_between_delay_and_delay_plus_tick():
+    wheel = TimerWheel(tick=0.5, slots=8)
+    start = wheel.last_tick
+    fired = []
+    wheel.schedule(1.0, lambda: fired.append("short"))
+    # Further than one revolution of the wheel (8 slots of 0.5s).
+    wheel.schedule(10.0, lambda: fired.append("long"))
+    wheel.advance(start + 0.9)
+    assert fired == []
+    wheel.advance(start + 1.5)
+    assert fired == ["short"]
+    wheel.advance(start + 9.9)
+    assert fired == ["short"]
+    wheel.advance(start + 10.5)
+    assert fired == ["short", "long"]
+    wheel.advance(start + 30.0)
+    assert fired == ["short", "long"]
+
+
+def test_cancelled_and_none_timers_never_fire():
+    wheel = TimerWheel(tick=0.5, slots=8)
+    start = wheel.last_tick
+    fired = []
+    wheel.schedule(1.0, lambda: fired.append("cancelled")).cancel()
+    wheel.schedule(None, lambda: fired.append("none"))
+    wheel.advance(start + 10.0)
+    assert fired == []
+
+
+def test_failing_callback_does_not_stop_the_others():
+    wheel = TimerWheel(tick=0.5, slots=8)
+    start = wheel.last_tick
+    fired = []
+    wheel.schedule(0.5, lambda: 1 / 0)
+    wheel.schedule(0.5, lambda: fired.append("after"))
+    wheel.advance(start + 2.0)
+    assert fired == ["after"]
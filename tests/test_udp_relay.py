@@ -0,0 +1,111 @@
+import socket
+import time
+
+import pytest
+
+from maki_proxy import UDP_HEADER_ROOM, DnsResolver, UdpRelay, parse_udp_header, write_udp_header
+
+
+@pytest.mark.parametrize("family, address", [(socket.AF_INET, "192.0.2.1"), (socket.AF_INET6, "2001:db8::1")])
+def test_udp_header_round_trip(family, address):
+    buffer = bytearray(UDP_HEADER_ROOM + 5)
+    buffer[UDP_HEADER_ROOM:] = b"hello"
+    start = write_udp_header(buffer, UDP_HEADER_ROOM, family, address, 53)
+    frag, address_type, parsed, port, payload = parse_udp_header(memoryview(buffer)[start:])
+    assert (frag, address_type, parsed, port, bytes(payload)) == \
+        (0, 4 if family == socket.AF_INET6 else 1, address, 53, b"hello")
+
+
+def test_udp_header_with_domain():
+    datagram = b"\x00\x00\x00\x03\x0bexample.com\x00\x35query"
+    assert parse_udp_header(memoryview(datagram))[1:4] == (3, "example.com", 53)
+
+
+@pytest.mark.parametrize("datagram", [b"\x00\x00", b"\x00\x00\x00\x01\x7f\x00", b"\x00\x00\x00\x03",
+                                      b"\x00\x00\x00\x03\x0bexample", b"\x00\x00\x00\x09\x00\x00"])
+def test_short_or_bad_udp_headers_raise_value_error(datagram):
+    with pytest.raises(ValueError):
+        parse_udp_header(memoryview(datagram))
+
+
+def test_udp_header_drops_the_ipv6_scope():
+    buffer = bytearray(UDP_HEADER_ROOM)
+    start = write_udp_header(buffer, UDP_HEADER_ROOM, socket.AF_INET6, "fe80::1%lo", 53)
+    assert parse_udp_header(memoryview(buffer)[start:])[2] == "fe80::1"
+
+
+@pytest.fixture
+def echo():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(2.0)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def relay():
+    relay = UdpRelay(DnsResolver())
+    relay.start()
+    yield relay
+    relay.stop()
+    relay.thread.join(2.0)
+    relay.resolver.close()
+
+
+def exchange(client, association, echo, host, payload, address_type=1):
+    """ Send payload to the echo socket through the relay, echo it back, returns what the client receives. """
+    if address_type == 3:
+        header = bytes([0, 0, 0, 3, len(host)]) + host.encode()
+    else:
+        header = bytes([0, 0, 0, 1]) + socket.inet_aton(host)
+    client.sendto(header + echo.getsockname()[1].to_bytes(2, "big") + payload,
+                  association.client_socket.getsockname())
+    data, address = echo.recvfrom(65536)
+    echo.sendto(data, address)
+    return client.recv(65536)
+
+
+def test_relay_round_trip_and_first_datagram_to_a_new_name(relay, echo):
+    association = relay.associate("127.0.0.1", "127.0.0.1")
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        client.bind(("127.0.0.1", 0))
+        client.settimeout(2.0)
+        reply = exchange(client, association, echo, "127.0.0.1", b"ping")
+        assert reply == b"\x00\x00\x00\x01" + socket.inet_aton("127.0.0.1") + \
+            echo.getsockname()[1].to_bytes(2, "big") + b"ping"
+        # Not cached yet, the datagram waits for the lookup instead of being dropped.
+        assert exchange(client, association, echo, "localhost", b"name", address_type=3).endswith(b"name")
+    # Counted right after the send, the reply can arrive first.
+    deadline = time.monotonic() + 2.0
+    while relay.stats()["packets_to_clients"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert relay.stats()["packets_to_clients"] == 2
+
+
+def test_failing_callback_drops_one_datagram_not_the_relay(relay, echo):
+    calls = []
+
+    def permits(domain, address, port):
+        calls.append(address)
+        if len(calls) == 1:
+            raise RuntimeError("ruleset lookup failed")
+        return True
+
+    association = relay.associate("127.0.0.1", "127.0.0.1", permits=permits)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        client.bind(("127.0.0.1", 0))
+        client.settimeout(2.0)
+        client.sendto(b"\x00\x00\x00\x01" + socket.inet_aton("127.0.0.1") + echo.getsockname()[1].to_bytes(2, "big")
+                      + b"lost", association.client_socket.getsockname())
+        assert exchange(client, association, echo, "127.0.0.1", b"kept").endswith(b"kept")
+    assert relay.thread.is_alive()
+    assert relay.stats()["packets_dropped"] == 1
+
+
+def test_commands_never_block_the_caller():
+    relay = UdpRelay(DnsResolver())
+    # Not started, nothing drains the wakeup socket.
+    for _ in range(100000):
+        relay._command(lambda _: None, None)
+    relay.resolver.close()
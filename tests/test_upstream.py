@@ -0,0 +1,107 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from maki_proxy import Request, Socks5Parser, Upstream, socks_reply_length, socks_request
+
+
+@pytest.mark.parametrize("address_type, address", [
+    (1, "192.0.2.1"), (3, "example.com"), (3, "bücher.de"), (4, "2001:db8::1"),
+])
+def test_socks_request_round_trips_through_the_parser(address_type, address):
+    parser = Socks5Parser()
+    parser.feed(b"\x05\x01\x00")
+    parser.next_event()
+    parser.select_method(0x00)
+    parser.feed(socks_request(address_type, address, 8080))
+    assert parser.next_event() == Request(1, address_type, address, 8080)
+    assert parser.leftover() == b""
+
+
+def test_socks_request_domain_length_counts_idna_bytes():
+    request = socks_request(3, "bücher.de", 80)
+    assert request[4] == len(b"xn--bcher-kva.de")
+    assert len(request) == 4 + 1 + request[4] + 2
+
+
+@pytest.mark.parametrize("header, length", [
+    (b"\x05\x00\x00\x01", 6), (b"\x05\x00\x00\x04", 18), (b"\x05\x00\x00\x03\x09", 11),
+])
+def test_socks_reply_length(header, length):
+    assert socks_reply_length(header) == length
+
+
+def test_socks_reply_failure_carries_the_reply_code():
+    with pytest.raises(Exception) as error:
+        socks_reply_length(b"\x05\x05\x00\x01")
+    assert error.value.reply_code == 0x05
+
+
+def fake_upstream(*behaviours):
+    """ Listening socket whose n-th connection is handled by behaviours[n], the last one repeats. """
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+
+    def serve():
+        for count in range(100):
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            behaviour = behaviours[min(count, len(behaviours) - 1)]
+            threading.Thread(target=behaviour, args=(connection,), daemon=True).start()
+    threading.Thread(target=serve, daemon=True).start()
+    return listener
+
+
+def http_ok_then_banner(connection):
+    with connection:
+        connection.recv(4096)
+        # The head's blank line split across segments, the destination speaking first right after it.
+        connection.sendall(b"HTTP/1.1 200 Connection established\r\nVia: test\r\n\r")
+        time.sleep(0.05)
+        connection.sendall(b"\nBANNER")
+        time.sleep(1)
+
+
+def http_stalled(connection):
+    with connection:
+        connection.recv(4096)
+        connection.sendall(b"HTTP/1.1 200 Connection established\r\n")
+        time.sleep(3)
+
+
+def close_on_request(connection):
+    connection.recv(4096)
+    connection.close()
+
+
+def test_http_connect_keeps_the_bytes_after_the_head():
+    with fake_upstream(http_ok_then_banner) as listener:
+        upstream = Upstream(f"http://127.0.0.1:{listener.getsockname()[1]}", pool_size=0)
+        with upstream.connect(1, "192.0.2.1", 80) as sock:
+            assert sock.recv(100) == b"BANNER"
+
+
+def test_stalled_http_connect_times_out_without_spinning():
+    with fake_upstream(http_stalled) as listener:
+        upstream = Upstream(f"http://127.0.0.1:{listener.getsockname()[1]}", pool_size=0, connect_timeout=0.5)
+        started, cpu = time.monotonic(), time.process_time()
+        with pytest.raises(OSError):
+            upstream.connect(1, "192.0.2.1", 80)
+        assert time.monotonic() - started < 1.5
+        assert time.process_time() - cpu < 0.25
+        assert upstream.failures == 1
+
+
+def test_stale_pooled_connection_is_retried_on_a_new_one():
+    with fake_upstream(close_on_request, http_ok_then_banner) as listener:
+        upstream = Upstream(f"http://127.0.0.1:{listener.getsockname()[1]}", pool_size=0)
+        upstream.pool.append((socket.create_connection(listener.getsockname()), time.monotonic()))
+        with upstream.connect(1, "192.0.2.1", 80) as sock:
+            assert sock.recv(100) == b"BANNER"
+        assert upstream.hits == 1
+        assert upstream.failures == 0